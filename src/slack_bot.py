@@ -2,19 +2,25 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
-import threading
-from typing import Optional
+import re
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Set
 
+import orjson
+from aiohttp import web
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
-from slack_bolt import App
-from slack_bolt.adapter.flask import SlackRequestHandler
-from slack_bolt.adapter.socket_mode import SocketModeHandler
+from slack_bolt.adapter.aiohttp import to_aiohttp_response, to_bolt_request
+from slack_bolt.adapter.socket_mode.aiohttp import AsyncSocketModeHandler
+from slack_bolt.async_app import AsyncApp
+from slack_sdk.signature import SignatureVerifier
 from slack_sdk.web import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
 
-from .replicate_client import ReplicateClient
+from .replicate_client import ReplicateClient, verify_webhook
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,39 +34,93 @@ REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
 REPLICATE_LORA_VERSION = os.getenv("REPLICATE_LORA_VERSION")
 PORT = int(os.getenv("PORT", "3000"))
 SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")
+PUBLIC_URL = os.getenv("PUBLIC_URL")
+REPLICATE_WEBHOOK_SECRET = os.getenv("REPLICATE_WEBHOOK_SECRET")
+MAX_GENERATIONS_PER_USER = int(os.getenv("MAX_GENERATIONS_PER_USER", "2"))
 
 if not (SLACK_BOT_TOKEN and SLACK_SIGNING_SECRET and REPLICATE_API_TOKEN and REPLICATE_LORA_VERSION):
     raise RuntimeError("Missing required environment variables.")
+if PUBLIC_URL and not REPLICATE_WEBHOOK_SECRET:
+    # Unsigned callbacks would let anyone post arbitrary "results" into Slack and the cache.
+    raise RuntimeError("REPLICATE_WEBHOOK_SECRET is required when PUBLIC_URL is set.")
+
+# Slack events, Replicate calls and the HTTP endpoints all share one event loop.
+app = AsyncApp(token=SLACK_BOT_TOKEN, signing_secret=SLACK_SIGNING_SECRET)
+signature_verifier = SignatureVerifier(SLACK_SIGNING_SECRET)
+replicate_client = ReplicateClient(
+    REPLICATE_API_TOKEN,
+    webhook_url=f"{PUBLIC_URL.rstrip('/')}/replicate/callback" if PUBLIC_URL else None,
+)
+# Resolved once at import (before the loop starts) so BOT_MENTION is a plain constant.
+BOT_USER_ID = WebClient(token=SLACK_BOT_TOKEN).auth_test()["user_id"]
+BOT_MENTION = f"<@{BOT_USER_ID}>"
+# Single pass over message text: trigger phrase plus the prompt after it.
+TRIGGER_RE = re.compile(r"\bLoRA\s+Model\b\s*(.*)", re.IGNORECASE | re.DOTALL)
+
+# Per-user slots so one person cannot monopolize the Replicate connection pool.
+# Entries live only while someone holds or waits on them.
+user_generation_slots: Dict[str, asyncio.Semaphore] = {}
+user_generation_refs: Dict[str, int] = {}
+# Strong references to running generations; the loop only keeps weak ones.
+generation_tasks: Set["asyncio.Task[None]"] = set()
+# Recently handled messages (channel:ts), shared by app_mention and message
+# events so neither a Slack retry nor the paired event generates twice.
+recent_messages: Deque[str] = deque(maxlen=4096)
+recent_message_keys: Set[str] = set()
+
+
+@asynccontextmanager
+async def user_generation_slot(user: str) -> AsyncIterator[None]:
+    slot = user_generation_slots.get(user)
+    if slot is None:
+        slot = user_generation_slots[user] = asyncio.Semaphore(MAX_GENERATIONS_PER_USER)
+    user_generation_refs[user] = user_generation_refs.get(user, 0) + 1
+    try:
+        async with slot:
+            yield
+    finally:
+        user_generation_refs[user] -= 1
+        if not user_generation_refs[user]:
+            del user_generation_refs[user]
+            del user_generation_slots[user]
 
-app = App(token=SLACK_BOT_TOKEN, signing_secret=SLACK_SIGNING_SECRET)
-flask_app = Flask(__name__)
-handler = SlackRequestHandler(app)
-replicate_client = ReplicateClient(REPLICATE_API_TOKEN)
-BOT_USER_ID = app.client.auth_test()["user_id"]
 
+def claim_message(event: Dict[str, Any]) -> bool:
+    """Return True the first time a message is seen, False for repeats."""
+    key = f"{event.get('channel')}:{event.get('ts')}"
+    if key in recent_message_keys:
+        return False
+    if len(recent_messages) == recent_messages.maxlen:
+        recent_message_keys.discard(recent_messages[0])
+    recent_messages.append(key)
+    recent_message_keys.add(key)
+    return True
 
-def generate_and_reply(
+
+async def generate_and_reply(
     *,
-    client: WebClient,
+    client: AsyncWebClient,
     channel: str,
     thread_ts: Optional[str],
     prompt: str,
+    user: Optional[str],
 ) -> None:
     logger.info(f"Generating image for prompt: {prompt}")
     try:
-        response = replicate_client.run_inference(
-            version=REPLICATE_LORA_VERSION,
-            prompt=prompt,
-            aspect_ratio="3:4",
-            num_outputs=1,
-        )
+        async with user_generation_slot(user or channel):
+            response = await replicate_client.run_inference(
+                version=REPLICATE_LORA_VERSION,
+                prompt=prompt,
+                aspect_ratio="3:4",
+                num_outputs=1,
+            )
         logger.info(f"Replicate prediction response: {response}")
         image_urls = response.get("output") or []
         if not image_urls:
             raise RuntimeError("Replicate did not return any image URLs.")
         image_url = image_urls[0]
 
-        post_response = client.chat_postMessage(
+        post_response = await client.chat_postMessage(
             channel=channel,
             thread_ts=thread_ts,
             text=f"Here is your imaginative childhood photo:\n{image_url}",
@@ -75,117 +135,146 @@ def generate_and_reply(
         logger.info(f"Posted image to Slack channel={channel} url={image_url} response={post_response}")
     except Exception as exc:  # noqa: BLE001
         logger.error(f"Generation failed: {exc}", exc_info=True)
-        client.chat_postMessage(
+        await client.chat_postMessage(
             channel=channel,
             thread_ts=thread_ts,
             text=f"Generation failed: {exc}",
         )
 
 
+def dispatch_generation(*, channel: str, thread_ts: Optional[str], prompt: str, user: Optional[str]) -> None:
+    task = asyncio.create_task(
+        generate_and_reply(client=app.client, channel=channel, thread_ts=thread_ts, prompt=prompt, user=user)
+    )
+    generation_tasks.add(task)
+    task.add_done_callback(generation_tasks.discard)
+
+
 @app.command("/childhood-photo")
-def handle_slash_command(ack, respond, command):
-    ack()
+async def handle_slash_command(ack, respond, command):
+    await ack()
     prompt = command.get("text", "").strip()
     if not prompt:
-        respond("Please provide a prompt, e.g. `/childhood-photo Your 6-year-old self at a science fair`.")
+        await respond("Please provide a prompt, e.g. `/childhood-photo Your 6-year-old self at a science fair`.")
         return
 
     channel_id = command["channel_id"]
     thread_ts = command.get("thread_ts") or command.get("command_ts")
-    respond(f"Got it! Creating: *{prompt}*")
+    await respond(f"Got it! Creating: *{prompt}*")
 
-    threading.Thread(
-        target=generate_and_reply,
-        kwargs={
-            "client": app.client,
-            "channel": channel_id,
-            "thread_ts": thread_ts,
-            "prompt": prompt,
-        },
-        daemon=True,
-    ).start()
+    dispatch_generation(channel=channel_id, thread_ts=thread_ts, prompt=prompt, user=command.get("user_id"))
 
 
 @app.event("app_mention")
-def handle_app_mention(body, say):
+async def handle_app_mention(body, say):
     logger.info(f"Received app_mention event: {body}")
     event = body.get("event") or {}
+    if not claim_message(event):
+        return
     text = event.get("text", "") or ""
-    prompt = text.replace(f"<@{BOT_USER_ID}>", "").strip()
+    prompt = text.replace(BOT_MENTION, "").strip()
     if not prompt:
-        say("Share a creative prompt and I'll generate a childhood photo!")
+        await say("Share a creative prompt and I'll generate a childhood photo!")
         return
 
     channel = event.get("channel")
     thread_ts = event.get("ts")
-    say(f"Working on: *{prompt}*")
-    threading.Thread(
-        target=generate_and_reply,
-        kwargs={
-            "client": app.client,
-            "channel": channel,
-            "thread_ts": thread_ts,
-            "prompt": prompt,
-        },
-        daemon=True,
-    ).start()
+    await say(f"Working on: *{prompt}*")
+    dispatch_generation(channel=channel, thread_ts=thread_ts, prompt=prompt, user=event.get("user"))
 
 
 @app.event("message")
-def handle_message(body, say):
-    logger.info(f"Received message event: {body}")
+async def handle_message(body, say):
     event = body.get("event") or {}
     # Skip bot messages and messages without text
     if event.get("bot_id") or event.get("subtype"):
         return
-    
-    text = event.get("text", "") or ""
-    # Check if bot is mentioned
-    if f"<@{BOT_USER_ID}>" in text or "LoRA Model" in text:
-        prompt = text.replace(f"<@{BOT_USER_ID}>", "").replace("LoRA Model", "").strip()
-        if not prompt:
-            say("Share a creative prompt and I'll generate a childhood photo!")
-            return
-
-        channel = event.get("channel")
-        thread_ts = event.get("ts")
-        say(f"Working on: *{prompt}*")
-        threading.Thread(
-            target=generate_and_reply,
-            kwargs={
-                "client": app.client,
-                "channel": channel,
-                "thread_ts": thread_ts,
-                "prompt": prompt,
-            },
-            daemon=True,
-        ).start()
-
-
-@flask_app.route("/slack/events", methods=["POST"])
-def slack_events() -> tuple[str, int]:
-    return handler.handle(request)
-
-
-@flask_app.route("/healthz", methods=["GET"])
-def healthcheck():
-    return jsonify({"status": "ok"})
 
+    text = event.get("text") or ""
+    # Mentions are handled by handle_app_mention; only the bare phrase triggers here.
+    if BOT_MENTION in text:
+        return
+    match = TRIGGER_RE.search(text)
+    if not match or not claim_message(event):
+        return
+    logger.info(f"Received message event: {body}")
+    prompt = match.group(1).strip()
+    if not prompt:
+        await say("Share a creative prompt and I'll generate a childhood photo!")
+        return
 
-def main() -> None:
-    if SLACK_APP_TOKEN:
-        logger.info("Starting bot in Socket Mode...")
-        handler = SocketModeHandler(app, SLACK_APP_TOKEN)
-        handler.start()
-    else:
-        logger.info(f"Starting bot in HTTP mode on port {PORT}...")
-        flask_app.run(host="0.0.0.0", port=PORT)
+    channel = event.get("channel")
+    thread_ts = event.get("ts")
+    await say(f"Working on: *{prompt}*")
+    dispatch_generation(channel=channel, thread_ts=thread_ts, prompt=prompt, user=event.get("user"))
+
+
+async def slack_events(request: web.Request) -> web.Response:
+    # Fast path: ack bot/edited/etc. message events without running Bolt's
+    # dispatcher. Slash commands are form-encoded and always go through Bolt.
+    if request.content_type == "application/json":
+        body = await request.read()
+        if not signature_verifier.is_valid_request(body, dict(request.headers)):
+            return web.Response(status=401)
+        event = orjson.loads(body).get("event") or {}
+        if event.get("type") == "message" and (event.get("bot_id") or event.get("subtype")):
+            return web.Response(status=200)
+    bolt_response = await app.async_dispatch(await to_bolt_request(request))
+    return await to_aiohttp_response(bolt_response)
+
+
+async def replicate_callback(request: web.Request) -> web.Response:
+    body = await request.read()
+    if not (REPLICATE_WEBHOOK_SECRET and verify_webhook(REPLICATE_WEBHOOK_SECRET, request.headers, body)):
+        logger.warning("Rejected Replicate webhook with invalid signature")
+        return web.Response(status=401)
+    try:
+        prediction = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return web.Response(status=400)
+    if not isinstance(prediction, dict):
+        return web.Response(status=400)
+    logger.info(f"Replicate webhook: id={prediction.get('id')} status={prediction.get('status')}")
+    replicate_client.resolve_webhook(prediction)
+    return web.Response(status=204)
 
 
-if __name__ == "__main__":
+async def healthcheck(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"}, dumps=lambda obj: orjson.dumps(obj).decode())
+
+
+def create_web_app() -> web.Application:
+    web_app = web.Application()
+    web_app.router.add_post("/slack/events", slack_events)
+    web_app.router.add_post("/replicate/callback", replicate_callback)
+    web_app.router.add_get("/healthz", healthcheck)
+    return web_app
+
+
+async def serve() -> None:
+    runner: Optional[web.AppRunner] = None
     try:
-        main()
+        # Replicate webhooks still need an HTTP listener in Socket Mode.
+        if PUBLIC_URL or not SLACK_APP_TOKEN:
+            runner = web.AppRunner(create_web_app())
+            await runner.setup()
+            await web.TCPSite(runner, "0.0.0.0", PORT).start()
+
+        if SLACK_APP_TOKEN:
+            logger.info("Starting bot in Socket Mode...")
+            await AsyncSocketModeHandler(app, SLACK_APP_TOKEN).start_async()
+        else:
+            logger.info(f"Starting bot in HTTP mode on port {PORT}...")
+            await asyncio.Event().wait()
     finally:
-        replicate_client.close()
+        if runner is not None:
+            await runner.cleanup()
+        await replicate_client.aclose()
+
+
+def main() -> None:
+    asyncio.run(serve())
 
 
+if __name__ == "__main__":
+    main()
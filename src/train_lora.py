@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import json
 import os
 from pathlib import Path
@@ -19,6 +20,10 @@ def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Train a Flux LoRA on Replicate")
     parser.add_argument("--dataset-dir", type=Path, default=Path("ved"), help="Folder with childhood photos")
     parser.add_argument("--archive-path", type=Path, default=Path("artifacts/dataset.zip"), help="Temp zip archive path")
+    parser.add_argument(
+        "--dataset-url",
+        help="URL of an already-hosted dataset zip; skips zipping and uploading --dataset-dir",
+    )
     parser.add_argument("--model-owner", default=os.getenv("REPLICATE_MODEL_OWNER", DEFAULT_MODEL_OWNER))
     parser.add_argument("--model-name", default=os.getenv("REPLICATE_MODEL_NAME", DEFAULT_MODEL_NAME))
     parser.add_argument("--max-train-steps", type=int, default=1200)
@@ -27,23 +32,17 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def main() -> None:
-    load_dotenv()
-    args = parse_args()
-
-    api_token = os.getenv("REPLICATE_API_TOKEN")
-    if not api_token:
-        raise RuntimeError("REPLICATE_API_TOKEN missing")
-
-    artifacts_dir = args.archive_path.parent
-    artifacts_dir.mkdir(parents=True, exist_ok=True)
-
-    archive_path = zip_dataset(args.dataset_dir, args.archive_path)
-
+async def train(args: argparse.Namespace, api_token: str) -> None:
     client = ReplicateClient(api_token)
     try:
-        dataset_url = client.upload_dataset(archive_path)
-        training = client.start_training(
+        if args.dataset_url:
+            dataset_url = args.dataset_url
+        else:
+            artifacts_dir = args.archive_path.parent
+            artifacts_dir.mkdir(parents=True, exist_ok=True)
+            archive_path = zip_dataset(args.dataset_dir, args.archive_path)
+            dataset_url = await client.upload_dataset(archive_path)
+        training = await client.start_training(
             model_owner=args.model_owner,
             model_name=args.model_name,
             input_params={
@@ -54,7 +53,7 @@ def main() -> None:
         )
         training_id = training["id"]
         print(f"Started training: {training_id}")
-        final_state = client.poll_training(training_id)
+        final_state = await client.poll_training(training_id)
         status = final_state["status"]
         print(f"Training finished with status: {status}")
         if status != "succeeded":
@@ -65,7 +64,18 @@ def main() -> None:
         args.output_json.write_text(json.dumps({"lora_version": lora_version}, indent=2))
         print(f"Wrote LoRA version id to {args.output_json}")
     finally:
-        client.close()
+        await client.aclose()
+
+
+def main() -> None:
+    load_dotenv()
+    args = parse_args()
+
+    api_token = os.getenv("REPLICATE_API_TOKEN")
+    if not api_token:
+        raise RuntimeError("REPLICATE_API_TOKEN missing")
+
+    asyncio.run(train(args, api_token))
 
 
 if __name__ == "__main__":
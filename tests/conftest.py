@@ -0,0 +1,51 @@
+import importlib
+from collections import deque
+
+import httpx
+import pytest
+from slack_sdk.web import WebClient
+
+from src.replicate_client import ReplicateClient
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """Make ReplicateClient backoff sleeps return immediately."""
+
+    async def _no_sleep(self, seconds):
+        return None
+
+    monkeypatch.setattr(ReplicateClient, "_sleep", _no_sleep)
+
+
+@pytest.fixture
+def make_client():
+    """Build a ReplicateClient whose requests are answered by ``handler``.
+
+    When ``requests`` is given, every request sent is appended to it.
+    """
+
+    def _make(handler, requests=None):
+        def record(request: httpx.Request):
+            if requests is not None:
+                requests.append(request)
+            return handler(request)
+
+        return ReplicateClient("token", transport=httpx.MockTransport(record))
+
+    return _make
+
+
+@pytest.fixture
+def slack_bot(monkeypatch):
+    """Import ``src.slack_bot`` offline, with fresh per-message state."""
+    for name in ("SLACK_BOT_TOKEN", "SLACK_SIGNING_SECRET", "REPLICATE_API_TOKEN", "REPLICATE_LORA_VERSION"):
+        monkeypatch.setenv(name, "test")
+    monkeypatch.delenv("PUBLIC_URL", raising=False)
+    monkeypatch.setattr(WebClient, "auth_test", lambda self, **kwargs: {"user_id": "UBOT"})
+    module = importlib.import_module("src.slack_bot")
+    monkeypatch.setattr(module, "recent_messages", deque(maxlen=module.recent_messages.maxlen))
+    monkeypatch.setattr(module, "recent_message_keys", set())
+    monkeypatch.setattr(module, "user_generation_slots", {})
+    monkeypatch.setattr(module, "user_generation_refs", {})
+    return module
@@ -0,0 +1,100 @@
+import asyncio
+
+import httpx
+import orjson
+
+from src.replicate_client import InMemoryCache
+
+
+def test_cache_evicts_least_recently_used():
+    cache = InMemoryCache(max_entries=2)
+    cache.set("a", {"id": "a"})
+    cache.set("b", {"id": "b"})
+    assert cache.get("a") == {"id": "a"}
+
+    cache.set("c", {"id": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"id": "a"}
+    assert cache.get("c") == {"id": "c"}
+
+
+def test_cache_expires_entries():
+    cache = InMemoryCache(max_age_s=0.0)
+    cache.set("a", {"id": "a"})
+    assert cache.get("a") is None
+
+
+def test_cache_respects_per_call_max_age():
+    cache = InMemoryCache()
+    cache.set("a", {"id": "a"})
+    assert cache.get("a", max_age_s=-1.0) is None
+    assert cache.get("a") == {"id": "a"}
+
+
+def _succeeded(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(201, json={"id": "p1", "status": "succeeded", "output": ["https://img"]})
+
+
+def test_run_inference_returns_cached_result_without_api_call(make_client):
+    requests = []
+
+    async def run():
+        client = make_client(_succeeded, requests)
+        first = await client.run_inference(version="v1", prompt="beach")
+        second = await client.run_inference(version="v1", prompt="beach")
+        await client.aclose()
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first == second
+    assert len(requests) == 1
+
+
+def test_run_inference_cache_disabled_calls_api_each_time(make_client):
+    requests = []
+
+    async def run():
+        client = make_client(_succeeded, requests)
+        for _ in range(2):
+            await client.run_inference(version="v1", prompt="beach", cache_options={"enabled": "off"})
+        await client.aclose()
+
+    asyncio.run(run())
+
+    assert len(requests) == 2
+
+
+def test_run_inference_only_caches_succeeded_predictions(make_client):
+    requests = []
+
+    def failed(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(201, json={"id": "p1", "status": "failed", "error": "nsfw"})
+
+    async def run():
+        client = make_client(failed, requests)
+        for _ in range(2):
+            await client.run_inference(version="v1", prompt="beach")
+        await client.aclose()
+
+    asyncio.run(run())
+
+    assert len(requests) == 2
+
+
+def test_run_inference_cache_key_omits_unset_seed(make_client):
+    requests = []
+
+    async def run():
+        client = make_client(_succeeded, requests)
+        await client.run_inference(version="v1", prompt="beach")
+        await client.run_inference(version="v1", prompt="beach", seed=None)
+        await client.run_inference(version="v1", prompt="beach", seed=7)
+        await client.aclose()
+
+    asyncio.run(run())
+
+    assert len(requests) == 2
+    assert "seed" not in orjson.loads(requests[0].content)["input"]
+    assert orjson.loads(requests[1].content)["input"]["seed"] == 7
@@ -0,0 +1,323 @@
+import asyncio
+import base64
+import email.parser
+import email.policy
+import hashlib
+import hmac
+import os
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+from src import replicate_client
+from src.replicate_client import ReplicateClient, ReplicateError, verify_webhook
+
+
+STREAM_URL = "https://stream.replicate.com/v1/files/p1"
+
+
+def _starting(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(201, json={"id": "p1", "status": "starting", "urls": {"stream": STREAM_URL}})
+
+
+def _run_with_stream(stream_response, make_client):
+    """Run one inference whose SSE stream behaves like ``stream_response``."""
+    gets = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            return _starting(request)
+        if str(request.url) == STREAM_URL:
+            return stream_response(request)
+        gets.append(request)
+        status = "processing" if len(gets) == 1 else "succeeded"
+        return httpx.Response(200, json={"id": "p1", "status": status, "output": ["https://img"]})
+
+    async def run():
+        client = make_client(handler)
+        try:
+            return await client.run_inference(version="v1", prompt="beach")
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run()), gets
+
+
+def test_stream_closed_before_done_falls_back_to_polling(make_client, no_sleep):
+    def dropped(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, text="event: output\ndata: https://partial\n\n")
+
+    result, gets = _run_with_stream(dropped, make_client)
+
+    assert result["status"] == "succeeded"
+    assert len(gets) == 2
+
+
+def test_stream_transport_error_falls_back_to_polling(make_client, no_sleep):
+    def broken(request: httpx.Request) -> httpx.Response:
+        raise httpx.ReadTimeout("stalled", request=request)
+
+    result, gets = _run_with_stream(broken, make_client)
+
+    assert result["status"] == "succeeded"
+    assert len(gets) == 2
+
+
+def test_stream_error_status_falls_back_to_polling(make_client, no_sleep):
+    def unavailable(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(503, text="stream unavailable")
+
+    result, gets = _run_with_stream(unavailable, make_client)
+
+    assert result["status"] == "succeeded"
+    assert len(gets) == 2
+
+
+def test_stream_timeout_is_bounded(make_client):
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if str(request.url) == STREAM_URL:
+            seen.append(request.extensions["timeout"])
+            return httpx.Response(200, text="event: done\ndata: {}\n\n")
+        return httpx.Response(200, json={"id": "p1", "status": "succeeded"})
+
+    async def run():
+        client = make_client(handler)
+        await client.stream_prediction({"id": "p1", "urls": {"stream": STREAM_URL}})
+        await client.aclose()
+
+    asyncio.run(run())
+
+    assert seen[0]["read"] == replicate_client.STREAM_READ_TIMEOUT_SECONDS
+
+
+def _gated_client(make_client, posts):
+    """Client whose POST /predictions blocks until the returned event is set."""
+    release = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        posts.append(request)
+        await release.wait()
+        return httpx.Response(201, json={"id": "p1", "status": "succeeded", "output": ["https://img"]})
+
+    return make_client(handler), release
+
+
+def test_concurrent_identical_inferences_share_one_prediction(make_client):
+    posts = []
+
+    async def run():
+        client, release = _gated_client(make_client, posts)
+        calls = [client.run_inference(version="v1", prompt="beach") for _ in range(5)]
+        gathered = asyncio.gather(*calls)
+        await asyncio.sleep(0.01)
+        release.set()
+        results = await gathered
+        await client.aclose()
+        return results
+
+    results = asyncio.run(run())
+
+    assert len(posts) == 1
+    assert all(result["output"] == ["https://img"] for result in results)
+
+
+def test_cancelled_waiter_does_not_cancel_shared_prediction(make_client):
+    posts = []
+
+    async def run():
+        client, release = _gated_client(make_client, posts)
+        first = asyncio.create_task(client.run_inference(version="v1", prompt="beach"))
+        second = asyncio.create_task(client.run_inference(version="v1", prompt="beach"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        result = await second
+        await client.aclose()
+        return first, result
+
+    first, result = asyncio.run(run())
+
+    assert first.cancelled()
+    assert result["status"] == "succeeded"
+    assert len(posts) == 1
+
+
+WEBHOOK_SECRET = "whsec_" + base64.b64encode(b"replicate-test-key").decode()
+WEBHOOK_BODY = b'{"id":"p1","status":"succeeded","output":["https://img"]}'
+
+
+def _signed_headers(body: bytes, timestamp: int, secret: str = WEBHOOK_SECRET) -> dict:
+    key = base64.b64decode(secret.removeprefix("whsec_"))
+    signed = f"msg_1.{timestamp}.".encode() + body
+    signature = base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode()
+    return {
+        "webhook-id": "msg_1",
+        "webhook-timestamp": str(timestamp),
+        "webhook-signature": f"v1,{signature}",
+    }
+
+
+def test_verify_webhook_accepts_valid_signature():
+    headers = _signed_headers(WEBHOOK_BODY, int(time.time()))
+    assert verify_webhook(WEBHOOK_SECRET, headers, WEBHOOK_BODY)
+
+
+def test_verify_webhook_rejects_tampered_body():
+    headers = _signed_headers(WEBHOOK_BODY, int(time.time()))
+    tampered = WEBHOOK_BODY.replace(b"https://img", b"https://evil")
+    assert not verify_webhook(WEBHOOK_SECRET, headers, tampered)
+
+
+def test_verify_webhook_rejects_stale_timestamp():
+    stale = int(time.time()) - replicate_client.WEBHOOK_TOLERANCE_SECONDS - 60
+    headers = _signed_headers(WEBHOOK_BODY, stale)
+    assert not verify_webhook(WEBHOOK_SECRET, headers, WEBHOOK_BODY)
+
+
+def test_verify_webhook_rejects_wrong_secret():
+    other = "whsec_" + base64.b64encode(b"someone-else").decode()
+    headers = _signed_headers(WEBHOOK_BODY, int(time.time()), secret=other)
+    assert not verify_webhook(WEBHOOK_SECRET, headers, WEBHOOK_BODY)
+    assert not verify_webhook("whsec_not-base64!", headers, WEBHOOK_BODY)
+
+
+def test_verify_webhook_rejects_non_ascii_signature():
+    headers = _signed_headers(WEBHOOK_BODY, int(time.time()))
+    headers["webhook-signature"] = "v1,é"
+    assert not verify_webhook(WEBHOOK_SECRET, headers, WEBHOOK_BODY)
+
+
+def test_poll_training_retries_transient_errors(make_client, no_sleep):
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if len(attempts) == 1:
+            raise httpx.ConnectError("reset", request=request)
+        return httpx.Response(200, json={"id": "t1", "status": "succeeded"})
+
+    async def run():
+        client = make_client(handler, attempts)
+        try:
+            return await client.poll_training("t1")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run())["status"] == "succeeded"
+    assert len(attempts) == 2
+
+
+def test_create_prediction_does_not_retry_after_request_was_sent(make_client, no_sleep):
+    posts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ReadTimeout("no response", request=request)
+
+    async def run():
+        client = make_client(handler, posts)
+        try:
+            await client.run_inference(version="v1", prompt="beach")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(run())
+    assert len(posts) == 1
+
+
+def test_create_prediction_retries_connect_errors(make_client, no_sleep):
+    posts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if len(posts) == 1:
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(201, json={"id": "p1", "status": "succeeded", "output": ["https://img"]})
+
+    async def run():
+        client = make_client(handler, posts)
+        try:
+            return await client.run_inference(version="v1", prompt="beach")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run())["status"] == "succeeded"
+    assert len(posts) == 2
+
+
+def test_send_releases_request_slot_during_backoff(make_client, monkeypatch):
+    free_slots = []
+
+    async def record_slots(self, seconds):
+        free_slots.append(self._request_slots._value)
+
+    monkeypatch.setattr(ReplicateClient, "_sleep", record_slots)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("refused", request=request)
+
+    async def run():
+        client = make_client(handler)
+        try:
+            await client.get_prediction("p1")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(run())
+    assert free_slots == [replicate_client.MAX_CONNECTIONS] * (replicate_client.REQUEST_ATTEMPTS - 1)
+
+
+def test_upload_dataset_sends_one_sized_multipart_file_part(make_client, tmp_path: Path):
+    archive = tmp_path / "data.zip"
+    archive.write_bytes(os.urandom(replicate_client.UPLOAD_CHUNK_SIZE + 17))
+    uploads = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        uploads.append((request, await request.aread()))
+        return httpx.Response(201, json={"upload_url": "https://files/data.zip"})
+
+    async def run():
+        client = make_client(handler)
+        try:
+            return await client.upload_dataset(archive)
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) == "https://files/data.zip"
+
+    request, body = uploads[0]
+    assert len(body) == int(request.headers["Content-Length"])
+    assert "Transfer-Encoding" not in request.headers
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {request.headers['Content-Type']}\r\n\r\n".encode() + body
+    )
+    parts = list(message.iter_parts())
+    assert len(parts) == 1
+    assert parts[0].get_param("name", header="content-disposition") == "file"
+    assert parts[0].get_filename() == "data.zip"
+    assert parts[0].get_content() == archive.read_bytes()
+
+
+def test_aclose_aborts_pending_poll(make_client):
+    gets = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            gets.append(request)
+        return httpx.Response(200, json={"id": "p1", "status": "processing"})
+
+    async def run():
+        client = make_client(handler)
+        task = asyncio.create_task(client.run_inference(version="v1", prompt="beach"))
+        while not gets:
+            await asyncio.sleep(0)
+        await client.aclose()
+        await asyncio.wait_for(task, timeout=0.5)
+
+    with pytest.raises(ReplicateError, match="Replicate client closed"):
+        asyncio.run(run())
+    assert len(gets) == 1
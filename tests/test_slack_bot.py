@@ -0,0 +1,110 @@
+import asyncio
+from collections import deque
+
+import pytest
+
+
+@pytest.fixture
+def dispatched(slack_bot, monkeypatch):
+    """Record generations instead of starting them."""
+    calls = []
+    monkeypatch.setattr(slack_bot, "dispatch_generation", lambda **kwargs: calls.append(kwargs))
+    return calls
+
+
+async def _say(text):
+    return None
+
+
+def _event(text, **fields):
+    return {"event": {"channel": "C1", "ts": "1700000000.000100", "user": "U1", "text": text, **fields}}
+
+
+def test_mention_and_message_pair_generates_once(slack_bot, dispatched):
+    body = _event("<@UBOT> LoRA Model a cat")
+
+    async def run():
+        await slack_bot.handle_message(body, _say)
+        await slack_bot.handle_app_mention(body, _say)
+        await slack_bot.handle_message(body, _say)
+
+    asyncio.run(run())
+
+    assert len(dispatched) == 1
+    assert dispatched[0]["prompt"] == "LoRA Model a cat"
+
+
+def test_slack_retry_does_not_generate_again(slack_bot, dispatched):
+    body = _event("LoRA Model a cat")
+
+    async def run():
+        await slack_bot.handle_message(body, _say)
+        await slack_bot.handle_message(body, _say)
+
+    asyncio.run(run())
+
+    assert [call["prompt"] for call in dispatched] == ["a cat"]
+
+
+def test_claim_message_eviction_keeps_set_and_deque_in_step(slack_bot, monkeypatch):
+    monkeypatch.setattr(slack_bot, "recent_messages", deque(maxlen=2))
+    events = [{"channel": "C1", "ts": str(ts)} for ts in range(3)]
+
+    assert all(slack_bot.claim_message(event) for event in events)
+
+    assert slack_bot.recent_message_keys == set(slack_bot.recent_messages) == {"C1:1", "C1:2"}
+    assert not slack_bot.claim_message(events[2])
+    assert slack_bot.claim_message(events[0])
+    assert slack_bot.recent_message_keys == set(slack_bot.recent_messages) == {"C1:2", "C1:0"}
+
+
+@pytest.mark.parametrize("text", ["flora model a cat", "LoRA Models of a cat", "LoRA Modelling"])
+def test_trigger_requires_whole_words(slack_bot, text):
+    assert slack_bot.TRIGGER_RE.search(text) is None
+
+
+@pytest.mark.parametrize(
+    "text", ["LoRA Model a cat", "lora model a cat", "LORA   MODEL\ta cat", "please LoRA\nModel  a cat"]
+)
+def test_trigger_extracts_prompt(slack_bot, text):
+    assert slack_bot.TRIGGER_RE.search(text).group(1).strip() == "a cat"
+
+
+def test_user_slot_entry_removed_after_last_holder(slack_bot):
+    async def run():
+        async with slack_bot.user_generation_slot("U1"):
+            async with slack_bot.user_generation_slot("U1"):
+                assert slack_bot.user_generation_refs == {"U1": 2}
+
+    asyncio.run(run())
+
+    assert slack_bot.user_generation_slots == {}
+    assert slack_bot.user_generation_refs == {}
+
+
+def test_user_slot_entry_removed_when_waiter_cancelled(slack_bot, monkeypatch):
+    monkeypatch.setattr(slack_bot, "MAX_GENERATIONS_PER_USER", 1)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def generate():
+            async with slack_bot.user_generation_slot("U1"):
+                await release.wait()
+
+        holder = asyncio.create_task(generate())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(generate())
+        await asyncio.sleep(0)
+        assert slack_bot.user_generation_refs == {"U1": 2}
+
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert slack_bot.user_generation_refs == {"U1": 1}
+        release.set()
+        await holder
+
+    asyncio.run(run())
+
+    assert slack_bot.user_generation_slots == {}
+    assert slack_bot.user_generation_refs == {}
@@ -27,3 +27,14 @@ def test_zip_dataset_invalid_dir(tmp_path: Path):
         zip_dataset(tmp_path / "missing", tmp_path / "out.zip")
 
 
+def test_zip_dataset_stores_precompressed_images(tmp_path: Path):
+    source_dir = tmp_path / "dataset"
+    source_dir.mkdir()
+    (source_dir / "photo.JPG").write_bytes(b"\xff\xd8" + b"0" * 256)
+    (source_dir / "caption.txt").write_text("a child at the beach " * 20)
+
+    result = zip_dataset(source_dir, tmp_path / "dataset.zip")
+
+    with zipfile.ZipFile(result, "r") as archive:
+        assert archive.getinfo("photo.JPG").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("caption.txt").compress_type == zipfile.ZIP_DEFLATED